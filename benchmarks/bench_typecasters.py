@@ -0,0 +1,89 @@
+"""
+Benchmarks the decode speed of each :class:`riopg.TypeCasters` mode, in rows per second.
+
+The rows are generated by the server and read into a client-side result first; only the
+``fetchall()`` that turns that result into Python objects is timed, so the numbers are the
+per-row decode cost of each mode. Modes whose decoder isn't installed (e.g. orjson) are skipped.
+
+    $ DB_URL=postgresql://127.0.0.1/postgres python benchmarks/bench_typecasters.py [rows]
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extensions import register_type
+
+from riopg.typecasters import RAW, TypeCasters
+
+DOCUMENT = json.dumps({
+    "id": 12345,
+    "name": "riopg",
+    "tags": ["postgres", "trio", "curio"],
+    "active": True,
+    "score": 0.75,
+    "owner": {"id": 1, "email": "user@example.com", "roles": ["admin", "user"]},
+})
+QUERIES = {
+    "jsonb": ("SELECT %s::jsonb FROM generate_series(1, %s);", DOCUMENT),
+    "numeric": ("SELECT %s::numeric FROM generate_series(1, %s);", "12345.6789"),
+    "uuid": ("SELECT %s::uuid FROM generate_series(1, %s);", str(uuid.uuid4())),
+}
+
+
+def _decoders():
+    yield "jsonb", "default", None
+    yield "jsonb", "json.loads", json.loads
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        yield "jsonb", "orjson.loads", orjson.loads
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        yield "jsonb", "ujson.loads", ujson.loads
+
+    yield "jsonb", "raw", RAW
+    yield "numeric", "default", None
+    yield "numeric", "Decimal", Decimal
+    yield "numeric", "float", float
+    yield "numeric", "raw", RAW
+    yield "uuid", "default", None
+    yield "uuid", "uuid.UUID", uuid.UUID
+    yield "uuid", "raw", RAW
+
+
+def bench(dsn: str, rows: int):
+    for name, label, decoder in _decoders():
+        # a fresh connection each time, so that only this mode's typecasters are registered
+        conn = psycopg2.connect(dsn)
+        try:
+            for caster in TypeCasters(**{name: decoder}).casters:
+                register_type(caster, conn)
+
+            sql, value = QUERIES[name]
+            cur = conn.cursor()
+            cur.execute(sql, (value, rows))
+
+            start = time.perf_counter()
+            cur.fetchall()
+            elapsed = time.perf_counter() - start
+        finally:
+            conn.close()
+
+        print("{:<8} {:<14} {:>14,.0f} rows/sec".format(name, label, rows / elapsed))
+
+
+if __name__ == "__main__":
+    if "DB_URL" not in os.environ:
+        sys.exit("DB_URL must be set to the database to benchmark against")
+
+    bench(os.environ["DB_URL"], int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -2,4 +2,6 @@
 riopg - a curio/trio library for connecting and interacting with PostgreSQL.
 """
 from riopg.connection import Connection
+from riopg.manager import PoolManager
 from riopg.pool import Pool, create_pool
+from riopg.typecasters import RAW, TypeCasters
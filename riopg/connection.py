@@ -16,15 +16,26 @@
 .. currentmodule:: riopg.connection
 """
 
+import re
 import socket
+from typing import Any, Iterable, List, Tuple, Union
 
 import inspect
 import multio
 from psycopg2 import OperationalError, connect
 from psycopg2._psycopg import connection
-from psycopg2.extensions import POLL_ERROR, POLL_OK, POLL_READ, POLL_WRITE
+from psycopg2.extensions import POLL_ERROR, POLL_OK, POLL_READ, POLL_WRITE, encodings
 
-from riopg import cursor as md_cursor
+from riopg import cursor as md_cursor, transaction as md_transaction, \
+    typecasters as md_typecasters
+
+#: Matches statements that change session state which outlives a transaction.
+_SESSION_STATE_RE = re.compile(
+    r"(?:^|;)\s*(?:SET\s+(?!LOCAL\b|TRANSACTION\b|CONSTRAINTS\b)|RESET\b|LISTEN\b|DECLARE\b"
+    r"|CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?TEMP(?:ORARY)?\b)"
+    r"|\bset_config\s*\(|\bpg_advisory_lock\b",
+    re.IGNORECASE
+)
 
 
 class Connection(object):
@@ -45,6 +56,18 @@ class Connection(object):
         #: time.
         self._lock = multio.Lock()
 
+        #: Statements waiting to be sent along with the next statement executed.
+        self._pending = []
+
+        #: The number of times pending statements have been sent.
+        self._flushes = 0
+
+        #: The stack of currently running transactions, outermost first.
+        self._transactions = []  # type: List[md_transaction.Transaction]
+
+        #: If this connection may have session state that needs resetting.
+        self._dirty = False
+
     async def __aenter__(self):
         return self
 
@@ -67,12 +90,18 @@ class Connection(object):
         return wrapper(self, original)
 
     @classmethod
-    async def open(cls, *args, **kwargs) -> 'Connection':
+    async def open(cls, *args, typecasters: 'md_typecasters.TypeCasters' = None,
+                   **kwargs) -> 'Connection':
         """
         Opens a new connection.
+
+        :param typecasters: The :class:`.TypeCasters` to register on the new connection, if any.
         """
         conn = cls()
         await conn._connect(*args, **kwargs)
+        if typecasters is not None:
+            typecasters.register(conn)
+
         return conn
 
     async def _wait_callback(self):
@@ -119,6 +148,76 @@ class Connection(object):
         self._sock = socket.fromfd(self._connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
         await self._wait_callback()
 
+    def _check_dirty(self, sql):
+        """
+        Marks this connection as dirty if the specified SQL changes session state.
+        """
+        if not isinstance(sql, str) or _SESSION_STATE_RE.search(sql):
+            self._dirty = True
+
+    def mark_dirty(self):
+        """
+        Marks this connection as having session state that needs resetting when it is released
+        back to a :class:`.Pool` using :data:`.pool.RESET_LAZY`.
+
+        Common statements that change session state, such as ``SET`` or ``CREATE TEMP TABLE``,
+        mark the connection as dirty automatically.
+        """
+        self._dirty = True
+
+    async def _execute(self, cur, sql=None, params=None):
+        """
+        Executes some SQL on a psycopg2 cursor, sending any pending statements first. If the SQL
+        is a string, the pending statements are sent in the same round trip.
+
+        :param cur: The psycopg2 cursor to execute on.
+        :param sql: The SQL to execute, or None to only send the pending statements.
+        :param params: The parameters to pass to the SQL.
+        """
+        async with self._lock:
+            # the pending statements are only taken once we hold the lock, so that they aren't
+            # lost if we're cancelled while waiting for it
+            pending = self._pending
+            if pending:
+                if isinstance(sql, str):
+                    query, query_params, sql = ";\n".join(pending + [sql]), params, None
+                else:
+                    query, query_params = ";\n".join(pending), None
+
+                self._pending = []
+                try:
+                    cur.execute(query, query_params)
+                except BaseException:
+                    # psycopg2 failed before sending anything (e.g. the wrong number of
+                    # parameters), so they're still pending
+                    self._pending = pending
+                    raise
+
+                self._flushes += 1
+                await self._wait_callback()
+
+            if sql is not None:
+                cur.execute(sql, params)
+                await self._wait_callback()
+
+    async def _execute_raw(self, sql: str = None, params=None):
+        """
+        Executes some SQL (and any pending statements) on a throwaway cursor, discarding the
+        results.
+        """
+        cur = self._connection.cursor()
+        try:
+            await self._execute(cur, sql, params)
+        finally:
+            cur.close()
+
+    async def _flush(self):
+        """
+        Sends any pending statements to the server in a round trip of their own.
+        """
+        if self._pending:
+            await self._execute_raw()
+
     def _cursor(self, **kwargs):
         """
         Internal implementation of acquiring a cursor.
@@ -135,6 +234,57 @@ class Connection(object):
         await cur.open()
         return cur
 
+    def transaction(self, *, isolation: str = None,
+                    readonly: bool = None) -> 'md_transaction.Transaction':
+        """
+        Creates a new transaction. This returns an object that can be used with ``async with``
+        to commit the transaction when done, or roll it back if an error happens.
+
+        Transactions can be nested; inner transactions use savepoints.
+
+        .. code-block:: python3
+
+            async with conn.transaction(isolation="serializable"):
+                await cur.execute("UPDATE ...")
+
+        :param isolation: The isolation level to use, e.g. ``"serializable"``.
+        :param readonly: If this transaction is read only (or read write, if False).
+        :return: A :class:`.transaction.Transaction` object attached to this connection.
+        """
+        return md_transaction.Transaction(self, isolation=isolation, readonly=readonly)
+
+    async def run_batch(self, statements: 'Iterable[Union[str, Tuple[str, Any]]]', *,
+                        isolation: str = None, readonly: bool = None):
+        """
+        Runs a list of statements atomically, in a single round trip. Any results they return are
+        discarded.
+
+        :param statements: The statements to run. Each statement is either some SQL, or a tuple
+            of some SQL and the parameters to pass to it.
+        :param isolation: The isolation level to use, e.g. ``"serializable"``.
+        :param readonly: If this transaction is read only (or read write, if False).
+        """
+        cur = self._connection.cursor()
+        codec = encodings[self._connection.encoding]
+        parts = []
+        try:
+            for statement in statements:
+                if isinstance(statement, str):
+                    self._check_dirty(statement)
+                    parts.append(statement)
+                else:
+                    sql, params = statement
+                    self._check_dirty(sql)
+                    parts.append(cur.mogrify(sql, params).decode(codec))
+        finally:
+            cur.close()
+
+        if not parts:
+            return
+
+        async with self.transaction(isolation=isolation, readonly=readonly) as tr:
+            await tr.commit(";\n".join(parts))
+
     async def close(self):
         """
         Closes this connection.
@@ -81,7 +81,19 @@ class Cursor(object):
         :param sql: The SQL to execute.
         :param params: The parameters to pass to the SQL query.
         """
-        return await self._connection._do_async(partial(self._cursor.execute, sql, params))
+        self._connection._check_dirty(sql)
+        # sends any pending transaction statements in the same round trip
+        return await self._connection._execute(self._cursor, sql, params)
+
+    async def callproc(self, procname: str, parameters: Sequence[Any] = None):
+        """
+        Calls a stored procedure in this cursor.
+
+        :param procname: The name of the procedure to call.
+        :param parameters: The parameters to pass to the procedure.
+        """
+        await self._connection._flush()
+        return await self._connection._do_async(self._cursor.callproc, procname, parameters)
 
     async def fetchone(self) -> Sequence[Any]:
         """
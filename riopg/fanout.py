@@ -0,0 +1,358 @@
+# This file is part of riopg.
+#
+# riopg is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# riopg is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with riopg.  If not, see <http://www.gnu.org/licenses/>.
+"""
+.. currentmodule:: riopg.fanout
+"""
+from typing import Any, Awaitable, Callable, Iterable, List, Sequence, Tuple, Union
+
+import multio
+from psycopg2 import sql as pg_sql
+
+from riopg import connection as md_connection, pool as md_pool, \
+    transaction as md_transaction
+
+#: Put on the queue by a worker when it has run out of items.
+_DONE = object()
+
+#: How long to wait for the server to cancel running queries when a fan-out is cancelled.
+_CANCEL_TIMEOUT = 5
+
+
+class _Failure(object):
+    """
+    Put on the queue by a worker when running an item raised an error.
+    """
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+async def _fetch_all(conn: 'md_connection.Connection',
+                     query: 'Union[str, Tuple[str, Any]]') -> 'List[Sequence[Any]]':
+    """
+    Runs a query, returning all of its rows (or None, if it doesn't return any).
+    """
+    if isinstance(query, str):
+        sql, params = query, None
+    else:
+        sql, params = query
+
+    async with (await conn.cursor()) as cur:
+        await cur.execute(sql, params)
+        if cur.description is None:
+            return None
+
+        return await cur.fetchall()
+
+
+class _FanOut(object):
+    """
+    A helper class that allows doing ``async with pool.as_completed()``.
+    """
+
+    def __init__(self, pool: 'md_pool.Pool',
+                 fn: 'Callable[[md_connection.Connection, Any], Awaitable[Any]]',
+                 items: Iterable[Any], concurrency: int = None):
+        """
+        :param pool: The :class:`.Pool` to use.
+        :param fn: The function to call with a connection and each item.
+        :param items: The items to run the function for.
+        :param concurrency: The maximum number of connections to use at once.
+        """
+        self._pool = pool
+        self._fn = fn
+        self._items = list(items)
+
+        # leave a connection free by default, so that the consumer can still use the pool
+        concurrency = min(concurrency or max(pool._pool_size - 1, 1), pool._pool_size)
+        self._concurrency = min(concurrency, len(self._items))
+
+        self._queue = None
+        self._task_manager = None
+        self._task_group = None
+
+        #: The number of workers that haven't finished yet.
+        self._running = 0
+
+        #: The connections that an item is currently running on.
+        self._in_flight = set()
+
+    async def __aenter__(self):
+        self._queue = multio.Queue(max(self._concurrency, 1))
+        self._task_manager = multio.asynclib.task_manager()
+        self._task_group = await self._task_manager.__aenter__()
+
+        # the workers share this iterator, so each item is only run once
+        items = iter(enumerate(self._items))
+        for _ in range(self._concurrency):
+            self._running += 1
+            await multio.asynclib.spawn(self._task_group, self._worker, items)
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if self._running:
+                # either something failed, or we were left early
+                try:
+                    await self._cancel_queries()
+                finally:
+                    await multio.asynclib.cancel_task_group(self._task_group)
+        finally:
+            task_manager, self._task_manager = self._task_manager, None
+            self._task_group = None
+            await task_manager.__aexit__(exc_type, exc_val, exc_tb)
+
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> 'Tuple[int, Any]':
+        while self._running:
+            value = await self._queue.get()
+            if value is _DONE:
+                self._running -= 1
+            elif isinstance(value, _Failure):
+                raise value.error
+            else:
+                return value
+
+        raise StopAsyncIteration
+
+    async def _cancel_queries(self):
+        """
+        Cancels the queries still running on the server, as cancelling a worker only closes its
+        connection.
+
+        This is done with ``pg_cancel_backend`` from a new connection, rather than
+        :meth:`psycopg2.extensions.connection.cancel`, which blocks the event loop.
+        """
+        pids = [conn._connection.get_backend_pid() for conn in self._in_flight
+                if not conn._connection.closed]
+        if not pids:
+            return
+
+        conn = None
+        try:
+            async with multio.asynclib.timeout_after(_CANCEL_TIMEOUT):
+                conn = await self._pool._connection_factory(self._pool.dsn)
+                await conn._execute_raw("SELECT pg_cancel_backend(pid) FROM unnest(%s) pid;",
+                                        (pids,))
+        except (Exception, multio.asynclib.TaskTimeout):
+            # the queries stop when the server next notices that their connection is closed
+            pass
+        finally:
+            if conn is not None:
+                await conn.close()
+
+    async def _worker(self, items: 'Iterable[Tuple[int, Any]]'):
+        """
+        Runs items on a single connection until there are none left.
+        """
+        conn = None
+        try:
+            conn = await self._pool.acquire()
+            for index, item in items:
+                self._in_flight.add(conn)
+                result = await self._fn(conn, item)
+                self._in_flight.discard(conn)
+                await self._queue.put((index, result))
+        except multio.asynclib.Cancelled:
+            # on curio, this is an Exception; it isn't a failure of the item
+            raise
+        except Exception as e:
+            self._in_flight.discard(conn)
+            await self._queue.put(_Failure(e))
+            return
+        finally:
+            if conn in self._in_flight:
+                # we were cancelled halfway through running an item, so the connection can't be
+                # reused
+                self._in_flight.discard(conn)
+                await conn.close()
+
+            if conn is not None:
+                await self._pool.release(conn)
+
+        await self._queue.put(_DONE)
+
+
+class _PartitionedScan(object):
+    """
+    A helper class that allows doing ``async with pool.scan()``.
+    """
+
+    def __init__(self, pool: 'md_pool.Pool', table: str, *, key: str = None,
+                 columns: Sequence[str] = None, where: str = None, params: Sequence[Any] = (),
+                 chunks: int = None, concurrency: int = None):
+        self._pool = pool
+        self._table = table
+        self._key = key
+        self._columns = columns
+        self._where = where
+        self._params = tuple(params)
+
+        if pool._pool_size < 2:
+            raise ValueError("Partitioned scans need a pool of at least two connections")
+
+        # one connection is held for the snapshot, and by default one is left free so that the
+        # consumer can still use the pool
+        self._concurrency = min(concurrency or max(pool._pool_size - 2, 1), pool._pool_size - 1)
+        self._chunks = chunks or self._concurrency
+
+        #: The connection holding the transaction that the snapshot is exported from.
+        self._conn = None  # type: md_connection.Connection
+        self._transaction = None  # type: md_transaction.Transaction
+
+        #: The ID of the exported snapshot that every chunk is read in.
+        self._snapshot = None  # type: str
+
+        self._fan_out = None  # type: _FanOut
+
+    async def __aenter__(self):
+        self._conn = await self._pool.acquire()
+        try:
+            # the transaction stays open until the scan is done, so that every chunk can be
+            # read in the same snapshot
+            self._transaction = self._conn.transaction(isolation="repeatable read",
+                                                       readonly=True)
+            await self._transaction.start()
+
+            queries = await self._plan()
+            self._fan_out = _FanOut(self._pool, self._fetch_chunk, queries, self._concurrency)
+            await self._fan_out.__aenter__()
+        except BaseException:
+            await self._finish()
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return await self._fan_out.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            await self._finish()
+
+    async def _finish(self):
+        """
+        Ends the snapshot transaction, and releases its connection.
+        """
+        conn, self._conn = self._conn, None
+        try:
+            if self._transaction is not None and not self._transaction._done:
+                await self._transaction.rollback()
+        except BaseException:
+            # don't hand the connection back in the middle of a transaction
+            await conn.close()
+            raise
+        finally:
+            await self._pool.release(conn)
+
+    async def _fetch_chunk(self, conn: 'md_connection.Connection',
+                           query: 'Tuple[str, Tuple[Any]]') -> 'List[Sequence[Any]]':
+        """
+        Reads a chunk in the exported snapshot.
+        """
+        sql, params = query
+        async with conn.transaction(isolation="repeatable read", readonly=True):
+            return await _fetch_all(conn, ("SET TRANSACTION SNAPSHOT %s;\n" + sql,
+                                           (self._snapshot,) + params))
+
+    async def __aiter__(self):
+        async for _, rows in self._fan_out:
+            for row in rows:
+                yield row
+
+    async def _plan(self) -> 'List[Tuple[str, Tuple[Any]]]':
+        """
+        Splits the scan up into chunks.
+
+        :return: A list of queries and parameters, one for each chunk.
+        """
+        table = pg_sql.SQL(".").join([pg_sql.Identifier(part) for part in self._table.split(".")])
+        if self._columns is None:
+            columns = pg_sql.SQL("*")
+        else:
+            columns = pg_sql.SQL(", ").join([pg_sql.Identifier(col) for col in self._columns])
+
+        conn = self._conn
+        table = table.as_string(conn._connection)
+        select = pg_sql.SQL("SELECT {} FROM ").format(columns).as_string(conn._connection) + table
+
+        async with (await conn.cursor()) as cur:
+            await cur.execute("SELECT pg_export_snapshot();")
+            self._snapshot = (await cur.fetchone())[0]
+
+            if self._key is None:
+                # split on page numbers
+                column = "ctid"
+                cast = "::tid"
+                # the table name is passed already quoted, so it resolves to the same table
+                await cur.execute("SELECT pg_relation_size(%s::regclass) / "
+                                  "current_setting('block_size')::int;", (table,))
+                lower, upper = 0, (await cur.fetchone())[0]
+            else:
+                column = pg_sql.Identifier(self._key).as_string(conn._connection)
+                cast = ""
+                bounds = "SELECT min({0}), max({0}) FROM {1}".format(column, table)
+                if self._where is not None:
+                    bounds += " WHERE ({})".format(self._where)
+
+                await cur.execute(bounds, self._params or None)
+                lower, upper = await cur.fetchone()
+                if lower is not None and not isinstance(lower, int):
+                    raise TypeError("Partitioned scans need an integer key")
+
+        chunks = self._chunks
+        if lower is None or upper - lower < chunks:
+            # not worth splitting up
+            chunks = 1
+
+        step = -(-(upper + 1 - lower) // chunks) if chunks > 1 else 0
+        queries = []
+        for i in range(chunks):
+            conditions, params = [], []
+            if i > 0:
+                conditions.append("{} >= %s{}".format(column, cast))
+                params.append(self._boundary(lower + i * step))
+
+            if i < chunks - 1:
+                condition = "{} < %s{}".format(column, cast)
+                if i == 0 and self._key is not None:
+                    condition = "({} OR {} IS NULL)".format(condition, column)
+
+                conditions.append(condition)
+                params.append(self._boundary(lower + (i + 1) * step))
+
+            if self._where is not None:
+                conditions.append("({})".format(self._where))
+
+            query = select
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+
+            queries.append((query, tuple(params) + self._params))
+
+        return queries
+
+    def _boundary(self, value: int) -> Union[int, str]:
+        """
+        :return: The parameter for a chunk boundary.
+        """
+        if self._key is None:
+            return "({},0)".format(value)
+
+        return value
@@ -0,0 +1,358 @@
+# This file is part of riopg.
+#
+# riopg is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# riopg is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with riopg.  If not, see <http://www.gnu.org/licenses/>.
+"""
+.. currentmodule:: riopg.manager
+"""
+import collections
+import time
+from typing import Callable, Hashable, NamedTuple
+
+import multio
+
+from riopg import connection as md_connection, pool as md_pool, typecasters as md_typecasters
+
+
+class PoolManagerStats(NamedTuple):
+    """
+    A snapshot of the connections held by a :class:`.PoolManager`, across all of its pools.
+    """
+    #: The number of pools currently held by the manager.
+    pools: int
+
+    #: The maximum number of connections the manager will keep open at once.
+    max_connections: int
+
+    #: The number of connections currently open, across all pools.
+    open: int
+
+    #: The number of open connections sitting idle, across all pools.
+    idle: int
+
+    #: The number of connections currently acquired, across all pools.
+    in_use: int
+
+    #: The number of pools that have been evicted over the lifetime of the manager.
+    evictions: int
+
+
+class _ManagedPool(md_pool.Pool):
+    """
+    A :class:`.Pool` whose connections are counted against the limit of a :class:`.PoolManager`.
+    """
+
+    def __init__(self, manager: 'PoolManager', key: Hashable, dsn: str, pool_size: int, *,
+                 connection_factory: 'Callable[[], md_connection.Connection]' = None,
+                 reset: str = md_pool.RESET_NONE,
+                 typecasters: 'md_typecasters.TypeCasters' = None):
+        super().__init__(dsn, pool_size, connection_factory=connection_factory, reset=reset,
+                         typecasters=typecasters)
+        self._manager = manager
+        self._task_group = manager._task_group
+
+        #: The key this pool is stored under in the manager.
+        self.key = key
+
+        #: The number of tasks currently waiting inside :meth:`._acquire`.
+        self._acquiring = 0
+
+        #: The number of tasks waiting for the manager to free a connection slot for this pool.
+        self._reserving = 0
+
+        #: The monotonic time this pool was last acquired from or released to.
+        self._last_used = time.monotonic()
+
+    def _is_idle(self) -> bool:
+        """
+        :return: If no connection is acquired, or being acquired, from this pool.
+        """
+        return self._in_use == 0 and self._acquiring == 0
+
+    async def _make_new_connection(self) -> 'md_connection.Connection':
+        if not await self._manager._reserve(self):
+            # a connection was released to this pool while we waited, so use that instead
+            return self._connections.popleft()
+
+        try:
+            return await super()._make_new_connection()
+        except BaseException:
+            await self._manager._free()
+            raise
+
+    async def _acquire(self) -> 'md_connection.Connection':
+        self._acquiring += 1
+        self._last_used = time.monotonic()
+        try:
+            await self._manager._trim_pools(exclude=self)
+            return await super()._acquire()
+        finally:
+            self._acquiring -= 1
+
+    async def _return_connection(self, conn: 'md_connection.Connection'):
+        await super()._return_connection(conn)
+        self._last_used = time.monotonic()
+
+        if conn._connection.closed:
+            await self._manager._free()
+        elif self._reserving:
+            # somebody in this pool is waiting to open a new connection, hand them ours instead
+            await self._manager._wake()
+        elif self._manager._waiting:
+            # somebody else is starved for a connection, give them ours (or a colder one)
+            await self._manager._evict_idle_connection()
+
+
+class PoolManager(object):
+    """
+    Manages a set of :class:`.Pool` objects, one per DSN or tenant key, sharing a single limit on
+    the number of open connections.
+
+    Pools are created lazily the first time a key is used. When the connection limit is reached,
+    idle connections are closed in the least recently used pools to make room for busier ones;
+    pools that have been idle the longest are closed entirely if there are more than
+    ``max_pools`` of them.
+
+    Pools should always be reached through the manager, as an evicted pool is closed. If the
+    manager is used with ``async with``, its pools reset connections in the background.
+    """
+
+    def __init__(self, max_connections: int = 100, *, pool_size: int = 12,
+                 max_pools: int = None, dsn_factory: Callable[[Hashable], str] = None,
+                 connection_factory: 'Callable[[], md_connection.Connection]' = None,
+                 reset: str = md_pool.RESET_NONE,
+                 typecasters: 'md_typecasters.TypeCasters' = None):
+        """
+        :param max_connections: The maximum number of connections to hold open across all pools.
+        :param pool_size: The maximum number of connections to hold in any one pool.
+        :param max_pools: The maximum number of pools to hold at once, or None for no limit.
+        :param dsn_factory: A callable that turns a key into a DSN. By default, keys are DSNs.
+        :param connection_factory: The connection factory callable passed to each pool.
+        :param reset: The strategy each pool uses to reset connections when they are released.
+            See :class:`.Pool`.
+        :param typecasters: The :class:`.TypeCasters` to register on each new connection, if any.
+        """
+        self.max_connections = max_connections
+        self._pool_size = pool_size
+        self._max_pools = max_pools
+        self._dsn_factory = dsn_factory or str
+        self._connection_factory = connection_factory
+        self._reset = reset
+        self._typecasters = typecasters
+
+        #: The task group that pools reset connections in, if any.
+        self._task_group = None
+        self._task_manager = None
+
+        #: The pools held by this manager, from least to most recently used.
+        self._pools = collections.OrderedDict()
+
+        #: The number of connections currently open across all pools.
+        self._open = 0
+
+        #: Set when a connection slot is freed, or a connection is handed back to a pool with
+        #: tasks waiting in :meth:`._reserve`.
+        self._wakeup = multio.Event()
+
+        #: The number of tasks waiting for a connection slot to become free.
+        self._waiting = 0
+
+        self._evictions = 0
+        self._closed = False
+
+    async def __aenter__(self):
+        self._task_manager = multio.asynclib.task_manager()
+        self._task_group = await self._task_manager.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            await self.close()
+        finally:
+            task_manager, self._task_manager = self._task_manager, None
+            self._task_group = None
+            await task_manager.__aexit__(exc_type, exc_val, exc_tb)
+
+        return False
+
+    async def _reserve(self, pool: '_ManagedPool') -> bool:
+        """
+        Reserves a connection slot for a new connection in the specified pool.
+
+        :return: True if a slot was reserved, or False if a connection was released to the pool
+            while waiting, and can be used instead.
+        """
+        if self._open >= self.max_connections:
+            await self._evict_idle_connection(exclude=pool)
+
+        self._waiting += 1
+        pool._reserving += 1
+        try:
+            while self._open >= self.max_connections:
+                if pool._connections:
+                    return False
+
+                await self._wakeup.wait()
+        finally:
+            self._waiting -= 1
+            pool._reserving -= 1
+
+        self._open += 1
+        return True
+
+    async def _wake(self):
+        """
+        Wakes every task waiting in :meth:`._reserve`.
+        """
+        wakeup, self._wakeup = self._wakeup, multio.Event()
+        await wakeup.set()
+
+    async def _free(self):
+        """
+        Frees a connection slot.
+        """
+        self._open -= 1
+        await self._wake()
+
+    async def _evict_idle_connection(self, exclude: '_ManagedPool' = None) -> bool:
+        """
+        Closes the longest idle connection in the least recently used pool that has one.
+
+        :param exclude: A pool to never take the connection from.
+        :return: If a connection was closed.
+        """
+        for key, pool in self._pools.items():
+            # pools with tasks waiting in _reserve are about to take their idle connections
+            if pool is exclude or pool._reserving or not pool._connections:
+                continue
+
+            conn = pool._connections.popleft()
+            await conn.close()
+            await self._free()
+
+            if pool._is_idle() and not pool._connections:
+                await self._evict_pool(key)
+
+            return True
+
+        return False
+
+    async def _evict_pool(self, key: Hashable):
+        """
+        Closes and removes a pool.
+        """
+        pool = self._pools.pop(key)
+        count = len(pool._connections)
+        await pool.close()
+        for _ in range(count):
+            await self._free()
+
+        self._evictions += 1
+
+    async def _trim_pools(self, exclude: '_ManagedPool' = None):
+        """
+        Evicts idle pools, least recently used first, until there are at most ``max_pools``.
+        """
+        if self._max_pools is None:
+            return
+
+        for key, pool in list(self._pools.items()):
+            if len(self._pools) <= self._max_pools:
+                return
+
+            if pool is not exclude and pool._is_idle():
+                await self._evict_pool(key)
+
+    def get_pool(self, key: Hashable) -> 'md_pool.Pool':
+        """
+        Gets the pool for the specified key, creating it if needed.
+
+        :param key: The DSN or tenant key to get the pool for.
+        :return: The :class:`.Pool` for that key.
+        """
+        if self._closed:
+            raise RuntimeError("The pool manager is closed")
+
+        try:
+            pool = self._pools[key]
+        except KeyError:
+            pool = _ManagedPool(self, key, self._dsn_factory(key), self._pool_size,
+                                connection_factory=self._connection_factory, reset=self._reset,
+                                typecasters=self._typecasters)
+            self._pools[key] = pool
+
+        self._pools.move_to_end(key)
+        return pool
+
+    def acquire(self, key: Hashable) -> 'md_pool._PoolConnectionAcquirer':
+        """
+        Acquires a connection from the pool for the specified key. Like :meth:`.Pool.acquire`,
+        this can be used with ``async with`` to automatically release it when done.
+
+        :param key: The DSN or tenant key to acquire a connection for.
+        """
+        return self.get_pool(key).acquire()
+
+    async def release(self, key: Hashable, conn: 'md_connection.Connection'):
+        """
+        Releases a connection.
+
+        :param key: The DSN or tenant key the connection was acquired for.
+        :param conn: The :class:`.Connection` to release back to its pool.
+        """
+        pool = self._pools.get(key)
+        if pool is None:
+            # the pool was closed with the manager while this connection was acquired
+            await conn.close()
+            await self._free()
+            return
+
+        await pool.release(conn)
+
+    async def evict_idle(self, idle_for: float = 0) -> int:
+        """
+        Closes every pool that has no connections acquired from it.
+
+        :param idle_for: Only evict pools that have not been used for this many seconds.
+        :return: The number of pools evicted.
+        """
+        cutoff = time.monotonic() - idle_for
+        evicted = 0
+        for key, pool in list(self._pools.items()):
+            if pool._is_idle() and pool._last_used <= cutoff:
+                await self._evict_pool(key)
+                evicted += 1
+
+        return evicted
+
+    def stats(self) -> 'PoolManagerStats':
+        """
+        Gets a snapshot of the connections held by this manager, across all of its pools.
+
+        :return: A :class:`.PoolManagerStats` for this manager.
+        """
+        pool_stats = [pool.stats() for pool in self._pools.values()]
+        return PoolManagerStats(
+            pools=len(pool_stats), max_connections=self.max_connections, open=self._open,
+            idle=sum(s.idle for s in pool_stats), in_use=sum(s.in_use for s in pool_stats),
+            evictions=self._evictions
+        )
+
+    async def close(self):
+        """
+        Closes this manager, and every pool in it.
+        """
+        for key in list(self._pools):
+            await self._evict_pool(key)
+
+        self._closed = True
@@ -16,28 +16,82 @@
 .. currentmodule:: riopg.pool
 """
 import collections
-from typing import Callable
+from typing import Any, Awaitable, Callable, Iterable, List, NamedTuple, Sequence, Tuple, Union
 
 import multio
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
-from riopg import connection as md_connection
+from riopg import connection as md_connection, fanout as md_fanout, \
+    typecasters as md_typecasters
+
+#: Don't reset connections when they are released.
+RESET_NONE = "none"
+
+#: Reset run-time parameters with ``RESET ALL`` when connections are released.
+RESET_ALL = "reset"
+
+#: Reset all session state with ``DISCARD ALL`` when connections are released.
+RESET_DISCARD = "discard"
+
+#: Reset all session state except prepared statements and cached plans when connections are
+#: released.
+RESET_SESSION = "session"
+
+#: Like :data:`.RESET_SESSION`, but only for connections marked dirty with
+#: :meth:`.Connection.mark_dirty`, or that ran a statement that changes session state.
+RESET_LAZY = "lazy"
+
+_RESET_SQL = {
+    RESET_ALL: "RESET ALL",
+    RESET_DISCARD: "DISCARD ALL",
+    # DISCARD ALL, minus DEALLOCATE ALL and DISCARD PLANS
+    RESET_SESSION: ";\n".join([
+        "CLOSE ALL",
+        "SET SESSION AUTHORIZATION DEFAULT",
+        "RESET ALL",
+        "UNLISTEN *",
+        "SELECT pg_advisory_unlock_all()",
+        "DISCARD TEMP",
+        "DISCARD SEQUENCES",
+    ]),
+}
+_RESET_SQL[RESET_LAZY] = _RESET_SQL[RESET_SESSION]
 
 
 async def create_pool(dsn: str, pool_size: int = 12, *,
-                      connection_factory: 'Callable[[], md_connection.Connection]' = None) \
-        -> 'Pool':
+                      connection_factory: 'Callable[[], md_connection.Connection]' = None,
+                      reset: str = RESET_NONE,
+                      typecasters: 'md_typecasters.TypeCasters' = None) -> 'Pool':
     """
     Creates a new :class:`.Pool`.
 
     :param dsn: The DSN to connect to the database with.
     :param pool_size: The number of connections to hold at any time.
     :param connection_factory: The pool factory callable to use to
+    :param reset: The strategy used to reset connections when they are released. See
+        :class:`.Pool`.
+    :param typecasters: The :class:`.TypeCasters` to register on each new connection, if any.
     :return: A new :class:`.Pool`.
     """
-    pool = Pool(dsn, pool_size, connection_factory=connection_factory)
+    pool = Pool(dsn, pool_size, connection_factory=connection_factory, reset=reset,
+                typecasters=typecasters)
     return pool
 
 
+class PoolStats(NamedTuple):
+    """
+    A snapshot of the connections held by a :class:`.Pool`.
+    """
+    #: The maximum number of connections the pool can hand out at once.
+    size: int
+
+    #: The number of open connections sitting idle in the pool.
+    idle: int
+
+    #: The number of connections currently acquired from the pool.
+    in_use: int
+
+
 class _PoolConnectionAcquirer:
     """
     A helper class that allows doing ``async with pool.acquire()``.
@@ -65,23 +119,55 @@ class _PoolConnectionAcquirer:
 class Pool(object):
     """
     Represents a pool of connections.
+
+    When a connection is released, it can be reset so that any session state left behind by one
+    task doesn't leak to the next. The ``reset`` strategy is one of :data:`.RESET_NONE` (the
+    default), :data:`.RESET_ALL`, :data:`.RESET_DISCARD`, :data:`.RESET_SESSION` or
+    :data:`.RESET_LAZY`. Any transaction left open is always rolled back first, unless the
+    strategy is :data:`.RESET_NONE`.
+
+    If the pool is used with ``async with``, resets are run in a background task, and
+    :meth:`.Pool.release` returns immediately; the connection is put back into the pool once it
+    has been reset. Otherwise, resets are run inside :meth:`.Pool.release`.
     """
 
     def __init__(self, dsn: str, pool_size: int = 12, *,
-                 connection_factory: 'Callable[[], md_connection.Connection]' = None):
+                 connection_factory: 'Callable[[], md_connection.Connection]' = None,
+                 reset: str = RESET_NONE, typecasters: 'md_typecasters.TypeCasters' = None):
+        if reset != RESET_NONE and reset not in _RESET_SQL:
+            raise ValueError("Unknown reset strategy '{}'".format(reset))
+
         self.dsn = dsn
+        self._reset = reset
         self._pool_size = pool_size
         self._connection_factory = connection_factory or md_connection.Connection.open
+        self._typecasters = typecasters
 
         self._sema = multio.Semaphore(pool_size)
         self._connections = collections.deque()
         self._closed = False
 
+        #: The number of connections currently acquired from this pool.
+        self._in_use = 0
+
+        #: The task group that connections are reset in, if any.
+        self._task_group = None
+        self._task_manager = None
+
     async def __aenter__(self):
+        self._task_manager = multio.asynclib.task_manager()
+        self._task_group = await self._task_manager.__aenter__()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.close()
+        try:
+            await self.close()
+        finally:
+            # wait for any outstanding resets
+            task_manager, self._task_manager = self._task_manager, None
+            self._task_group = None
+            await task_manager.__aexit__(exc_type, exc_val, exc_tb)
+
         return False
 
     async def _make_new_connection(self) -> 'md_connection.Connection':
@@ -91,6 +177,9 @@ class Pool(object):
         :return: A new :class:`.Connection` or subclass of.
         """
         conn = await self._connection_factory(self.dsn)
+        if self._typecasters is not None:
+            self._typecasters.register(conn)
+
         return conn
 
     async def _acquire(self) -> 'md_connection.Connection':
@@ -102,10 +191,16 @@ class Pool(object):
         # wait for a new connection to be added
         await self._sema.acquire()
         try:
-            conn = self._connections.popleft()
-        except IndexError:
-            conn = await self._make_new_connection()
+            try:
+                conn = self._connections.popleft()
+            except IndexError:
+                conn = await self._make_new_connection()
+        except BaseException:
+            # don't leak the slot if we couldn't connect
+            await multio._maybe_await(self._sema.release())
+            raise
 
+        self._in_use += 1
         return conn
 
     def acquire(self) -> '_PoolConnectionAcquirer':
@@ -127,13 +222,189 @@ class Pool(object):
         if conn is None:
             raise ValueError("Connection cannot be none")
 
+        needs_reset = not conn._connection.closed and self._needs_reset(conn)
+        # forget about any transactions the borrower didn't finish, so that the next borrower
+        # doesn't send them
+        conn._pending.clear()
+        conn._transactions.clear()
+
+        if self._reset == RESET_NONE or conn._connection.closed \
+                or (self._reset == RESET_LAZY and not needs_reset):
+            await self._return_connection(conn)
+        elif self._task_group is not None:
+            await multio.asynclib.spawn(self._task_group, self._reset_connection, conn)
+        else:
+            await self._reset_connection(conn)
+
+    @staticmethod
+    def _needs_reset(conn: 'md_connection.Connection') -> bool:
+        """
+        :return: If the connection has session state that a lazy reset should clear.
+        """
+        return conn._dirty or bool(conn._pending) or bool(conn._transactions) \
+            or conn._connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+
+    async def _reset_connection(self, conn: 'md_connection.Connection'):
+        """
+        Resets a released connection, then puts it back into the pool.
+        """
+        try:
+            if conn._connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                # this can't be sent with the reset, as a multi-statement query runs in an
+                # implicit transaction block and DISCARD ALL refuses to run inside one
+                await conn._execute_raw("ROLLBACK")
+
+            await conn._execute_raw(_RESET_SQL[self._reset])
+        except Exception:
+            # not worth keeping around
+            await conn.close()
+        except BaseException:
+            # we may have been cancelled halfway through the reset, so the connection can't be
+            # reused
+            await conn.close()
+            raise
+        else:
+            conn._dirty = False
+        finally:
+            await self._return_connection(conn)
+
+    async def _return_connection(self, conn: 'md_connection.Connection'):
+        """
+        Puts a released connection back into the pool.
+        """
+        if not conn._connection.closed:
+            if self._closed:
+                await conn.close()
+            else:
+                self._connections.append(conn)
+
+        self._in_use -= 1
         await multio._maybe_await(self._sema.release())
 
-        if conn._connection.closed:
-            # thanks a lot
-            return
+    def as_completed(self, fn: 'Callable[[md_connection.Connection, Any], Awaitable[Any]]',
+                     items: Iterable[Any], *, concurrency: int = None) -> 'md_fanout._FanOut':
+        """
+        Runs ``await fn(connection, item)`` for each item, on up to ``concurrency`` connections
+        from this pool at once. This returns an object that must be used with ``async with``, and
+        can then be iterated over with ``async for`` to get ``(index, result)`` tuples as each
+        item finishes.
+
+        If running any item raises an error, the others are cancelled and the error is raised
+        from the ``async for``. Leaving the ``async with`` early cancels any items still running;
+        their queries are cancelled on the server, and their connections are closed.
+
+        Workers hold their connection while waiting for the ``async for`` to take their result.
+        If ``concurrency`` is the size of the pool, the body of the ``async for`` must not
+        acquire a connection from this pool, or it will wait forever.
+
+        .. code-block:: python3
+
+            async with pool.as_completed(fetch_user, user_ids) as results:
+                async for index, user in results:
+                    ...
+
+        :param fn: The function to call with a connection and each item.
+        :param items: The items to run the function for.
+        :param concurrency: The maximum number of connections to use at once. Defaults to one
+            less than the size of the pool.
+        """
+        if self._closed:
+            raise RuntimeError("The pool is closed")
+
+        return md_fanout._FanOut(self, fn, items, concurrency)
+
+    async def map(self, fn: 'Callable[[md_connection.Connection, Any], Awaitable[Any]]',
+                  items: Iterable[Any], *, concurrency: int = None,
+                  ordered: bool = True) -> List[Any]:
+        """
+        Runs ``await fn(connection, item)`` for each item, on up to ``concurrency`` connections
+        from this pool at once. If any item raises an error, the others are cancelled.
+
+        :param fn: The function to call with a connection and each item.
+        :param items: The items to run the function for.
+        :param concurrency: The maximum number of connections to use at once. Defaults to one
+            less than the size of the pool.
+        :param ordered: If the results should be in the same order as the items. Otherwise, they
+            are in the order they finished.
+        :return: A list of the results.
+        """
+        items = list(items)
+        results = [None] * len(items) if ordered else []
+        async with self.as_completed(fn, items, concurrency=concurrency) as completed:
+            async for index, result in completed:
+                if ordered:
+                    results[index] = result
+                else:
+                    results.append(result)
+
+        return results
+
+    async def fan_out(self, queries: 'Iterable[Union[str, Tuple[str, Any]]]', *,
+                      concurrency: int = None,
+                      ordered: bool = True) -> 'List[List[Sequence[Any]]]':
+        """
+        Runs independent queries on up to ``concurrency`` connections from this pool at once. If
+        any query raises an error, the others are cancelled.
 
-        self._connections.append(conn)
+        :param queries: The queries to run. Each query is either some SQL, or a tuple of some SQL
+            and the parameters to pass to it.
+        :param concurrency: The maximum number of connections to use at once. Defaults to one
+            less than the size of the pool.
+        :param ordered: If the results should be in the same order as the queries. Otherwise,
+            they are in the order they finished.
+        :return: A list of the rows returned by each query (or None, for queries that don't
+            return rows).
+        """
+        return await self.map(md_fanout._fetch_all, queries, concurrency=concurrency,
+                              ordered=ordered)
+
+    def scan(self, table: str, *, key: str = None, columns: Sequence[str] = None,
+             where: str = None, params: Sequence[Any] = (), chunks: int = None,
+             concurrency: int = None) -> 'md_fanout._PartitionedScan':
+        """
+        Scans a table in parallel, by splitting it into chunks that are each read on a connection
+        from this pool. This returns an object that must be used with ``async with``, and can
+        then be iterated over with ``async for`` to get the rows as each chunk is read. Rows come
+        in no particular order.
+
+        The table is split on ranges of ``key``, which must be an integer column, or on ranges
+        of pages (using ``ctid``) if no key is given. Before PostgreSQL 14, a ``ctid`` range
+        can't be read without scanning the whole table, so each chunk reads all of it; give a
+        ``key`` with an index on older servers.
+
+        Every chunk is read in the same snapshot, exported from a transaction that is held open
+        on one more connection from this pool for the duration of the scan. The pool must hold
+        at least two connections.
+
+        .. code-block:: python3
+
+            async with pool.scan("events", key="id", where="kind = %s", params=("click",)) as rows:
+                async for row in rows:
+                    ...
+
+        :param table: The name of the table to scan.
+        :param key: The integer column to split the table on, if any.
+        :param columns: The columns to get. Defaults to all of them.
+        :param where: A condition rows must meet, as SQL.
+        :param params: The parameters to pass to the condition.
+        :param chunks: The number of chunks to split the table into. Defaults to the concurrency.
+        :param concurrency: The maximum number of connections to read chunks on at once.
+            Defaults to two less than the size of the pool, and is at most one less. If it is one
+            less, the body of the ``async for`` must not acquire a connection from this pool.
+        """
+        if self._closed:
+            raise RuntimeError("The pool is closed")
+
+        return md_fanout._PartitionedScan(self, table, key=key, columns=columns, where=where,
+                                          params=params, chunks=chunks, concurrency=concurrency)
+
+    def stats(self) -> 'PoolStats':
+        """
+        Gets a snapshot of the connections held by this pool.
+
+        :return: A :class:`.PoolStats` for this pool.
+        """
+        return PoolStats(size=self._pool_size, idle=len(self._connections), in_use=self._in_use)
 
     async def close(self):
         """
@@ -1,7 +1,11 @@
 import os
+import multio
 import pytest
+from psycopg2 import DataError, IntegrityError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
-from riopg import create_pool, Connection
+from riopg import create_pool, Connection, PoolManager, RAW, TypeCasters
+from riopg.pool import RESET_DISCARD, RESET_LAZY
 
 
 async def get_pool():
@@ -72,6 +76,74 @@ async def test_cursor():
             assert counter == 3
 
 
+async def test_typecasters():
+    typecasters = TypeCasters(json=RAW, jsonb=lambda value: "decoded", numeric=float)
+    conn = await Connection.open(os.environ.get("DB_URL"), typecasters=typecasters)
+    async with conn:
+        cur = await conn.cursor()
+        await cur.execute("""SELECT '{"a": 1}'::json, '{}'::jsonb, 1.5::numeric, """
+                          """ARRAY['[]'::jsonb, NULL], NULL::jsonb;""")
+        result = await cur.fetchone()
+        assert result == ('{"a": 1}', "decoded", 1.5, ["decoded", None], None)
+
+
+async def test_transaction():
+    conn = await get_connection()
+    async with conn:
+        cur = await conn.cursor()
+        await cur.execute("""
+        DROP TABLE IF EXISTS counters;
+        CREATE TABLE counters (id INTEGER PRIMARY KEY);
+        """)
+
+        async with conn.transaction(isolation="serializable"):
+            await cur.execute("INSERT INTO counters VALUES (1);")
+            async with conn.transaction():
+                await cur.execute("INSERT INTO counters VALUES (2);")
+
+            with pytest.raises(ZeroDivisionError):
+                async with conn.transaction():
+                    await cur.execute("INSERT INTO counters VALUES (3);")
+                    1 / 0
+
+        with pytest.raises(ZeroDivisionError):
+            async with conn.transaction():
+                await cur.execute("INSERT INTO counters VALUES (4);")
+                1 / 0
+
+        # a statement that fails before being sent doesn't lose the BEGIN (or savepoint)
+        with pytest.raises(ZeroDivisionError):
+            async with conn.transaction():
+                with pytest.raises(TypeError):
+                    await cur.execute("INSERT INTO counters VALUES (%s);", (9, 10))
+
+                with pytest.raises(TypeError):
+                    async with conn.transaction():
+                        await cur.execute("INSERT INTO counters VALUES (%s);", (9, 10))
+
+                await cur.execute("INSERT INTO counters VALUES (9);")
+                assert conn._connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+                1 / 0
+
+        # nothing is sent for an empty transaction
+        async with conn.transaction(readonly=True):
+            pass
+
+        assert not conn._pending
+
+        async with conn.transaction() as tr:
+            await tr.commit("INSERT INTO counters VALUES (%s);", (5,))
+
+        await conn.run_batch(["INSERT INTO counters VALUES (6);",
+                              ("INSERT INTO counters VALUES (%s);", (7,))])
+        with pytest.raises(IntegrityError):
+            await conn.run_batch(["INSERT INTO counters VALUES (8);",
+                                  "INSERT INTO counters VALUES (1);"])
+
+        await cur.execute("SELECT id FROM counters ORDER BY id;")
+        assert (await cur.fetchall()) == [(1,), (2,), (5,), (6,), (7,)]
+
+
 async def test_pool():
     pool = await get_pool()
     async with pool:
@@ -90,7 +162,159 @@ async def test_pool():
         conn = await pool.acquire()
         await pool.release(conn)
 
+        # an unfinished transaction isn't sent by the next borrower
+        async with pool.acquire() as conn:
+            await conn.transaction().start()
+
+        assert not conn._pending and not conn._transactions
+
     assert pool._connections[0].closed
 
     with pytest.raises(RuntimeError):
         await pool.acquire()
+
+
+async def test_pool_fan_out():
+    pool = await create_pool(os.environ.get("DB_URL"), 4)
+    async with pool:
+        results = await pool.fan_out(["SELECT 1;", ("SELECT %s;", (2,)), "SELECT 3;"])
+        assert results == [[(1,)], [(2,)], [(3,)]]
+
+        with pytest.raises(DataError):
+            await pool.fan_out(["SELECT pg_sleep(10);", "SELECT 1 / 0;"])
+
+        async with pool.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute("""
+            DROP TABLE IF EXISTS "Scanned";
+            CREATE TABLE "Scanned" AS SELECT generate_series(1, 1000) AS id;
+            INSERT INTO "Scanned" VALUES (NULL);
+            """)
+
+        async with pool.scan("Scanned", key="id", chunks=7) as rows:
+            ids = [row[0] async for row in rows]
+
+        assert len(ids) == 1001
+        assert sorted(filter(None, ids)) == list(range(1, 1001))
+
+        async with pool.scan("Scanned", where="id <= %s", params=(10,)) as rows:
+            assert len([row async for row in rows]) == 10
+
+
+async def test_pool_fan_out_cancel():
+    async def identity(conn, item):
+        return item
+
+    pool = await create_pool(os.environ.get("DB_URL"), 4)
+    async with pool:
+        # the worker is only waiting to hand over its result, so its connection is kept
+        async with pool.as_completed(identity, range(10), concurrency=1) as results:
+            async for index, item in results:
+                break
+
+        stats = pool.stats()
+        assert stats.idle == 1 and stats.in_use == 0
+        assert not pool._connections[0].closed
+
+    async def connection_factory(dsn):
+        raise OSError("too many connections")
+
+    pool = await create_pool(os.environ.get("DB_URL"), 4, connection_factory=connection_factory)
+    with pytest.raises(OSError):
+        await pool.fan_out(["SELECT 1;", "SELECT 2;"])
+
+    assert pool.stats().in_use == 0
+
+async def test_pool_reset():
+    pool = await create_pool(os.environ.get("DB_URL"), 1, reset=RESET_LAZY)
+    async with pool:
+        async with pool.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute("SELECT 1;")
+            assert not conn._dirty
+            await cur.execute("SET application_name = 'riopg_dirty';")
+            assert conn._dirty
+
+        # the pool only holds one connection, so this waits for the reset to finish
+        async with pool.acquire() as conn2:
+            assert conn2 is conn
+            assert not conn2._dirty
+            cur = await conn2.cursor()
+            await cur.execute("SHOW application_name;")
+            assert (await cur.fetchone()) != ("riopg_dirty",)
+
+
+async def test_pool_reset_failed_transaction():
+    pool = await create_pool(os.environ.get("DB_URL"), 1, reset=RESET_DISCARD)
+    async with pool:
+        async with pool.acquire() as conn:
+            cur = await conn.cursor()
+            await cur.execute("BEGIN;")
+            with pytest.raises(DataError):
+                await cur.execute("SELECT 1 / 0;")
+
+        async with pool.acquire() as conn2:
+            assert conn2 is conn, "Connection was not reset"
+            assert not conn2.closed
+            cur = await conn2.cursor()
+            await cur.execute("SELECT 1;")
+            assert (await cur.fetchone()) == (1,)
+
+
+async def test_pool_manager():
+    manager = PoolManager(max_connections=1, max_pools=1,
+                          dsn_factory=lambda key: os.environ.get("DB_URL"))
+    async with manager:
+        async with manager.acquire("a") as conn:
+            cur = await conn.cursor()
+            await cur.execute("SELECT 1;")
+            assert (await cur.fetchone()) == (1,)
+
+        assert manager.stats().idle == 1
+
+        # the idle pool for "a" is evicted to make room for "b"
+        async with manager.acquire("b") as conn2:
+            assert conn2 is not conn
+            assert conn.closed
+            stats = manager.stats()
+            assert stats.pools == 1
+            assert stats.open == stats.in_use == 1
+
+        assert await manager.evict_idle() == 1
+        assert manager.stats().open == 0
+
+    with pytest.raises(RuntimeError):
+        manager.acquire("a")
+
+    # a connection still acquired when the manager closes is closed when it is released
+    manager = PoolManager(dsn_factory=lambda key: os.environ.get("DB_URL"))
+    async with manager:
+        conn = await manager.acquire("a")
+
+    assert manager.stats().open == 1
+    await manager.release("a", conn)
+    assert conn.closed
+    assert manager.stats().open == 0
+
+
+async def test_pool_manager_hand_off():
+    manager = PoolManager(max_connections=1, pool_size=2,
+                          dsn_factory=lambda key: os.environ.get("DB_URL"))
+    async with manager:
+        conn = await manager.acquire("a")
+        acquired = []
+
+        async def acquire():
+            async with manager.acquire("a") as conn2:
+                acquired.append(conn2)
+
+        async with multio.asynclib.task_manager() as tg:
+            await multio.asynclib.spawn(tg, acquire)
+            await multio.asynclib.sleep(0.1)
+
+            # the waiter takes the released connection, instead of closing it and reconnecting
+            await manager.release("a", conn)
+
+        assert acquired == [conn]
+        assert not conn.closed
+        assert manager.stats().open == 1
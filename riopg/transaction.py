@@ -0,0 +1,194 @@
+# This file is part of riopg.
+#
+# riopg is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# riopg is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with riopg.  If not, see <http://www.gnu.org/licenses/>.
+"""
+.. currentmodule:: riopg.transaction
+"""
+from typing import Any, Dict, Tuple, Union
+
+from riopg import connection as md_connection
+
+_ISOLATION_LEVELS = {
+    "READ UNCOMMITTED", "READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE",
+}
+
+
+class Transaction(object):
+    """
+    Represents a transaction, or a savepoint inside an outer transaction.
+
+    Statements that begin or end a transaction don't cost a round trip of their own; they are
+    sent along with the next statement executed on the connection. A transaction that never
+    executes anything never talks to the server at all.
+
+    Do not construct this object manually; use :meth:`.Connection.transaction`.
+    """
+
+    def __init__(self, connection: 'md_connection.Connection', *,
+                 isolation: str = None, readonly: bool = None):
+        """
+        :param connection: The :class:`.Connection` object this transaction was created under.
+        :param isolation: The isolation level to use, e.g. ``"serializable"``.
+        :param readonly: If this transaction is read only (or read write, if False).
+        """
+        if isolation is not None:
+            isolation = isolation.upper().replace("_", " ")
+            if isolation not in _ISOLATION_LEVELS:
+                raise ValueError("Unknown isolation level '{}'".format(isolation))
+
+        self._connection = connection
+        self.isolation = isolation
+        self.readonly = readonly
+
+        #: The name of the savepoint used, if this transaction is nested.
+        self._savepoint = None  # type: str
+
+        #: The flush count and pending length of the connection when this transaction started.
+        #: If the flush count is unchanged, nothing has been sent to the server yet.
+        self._started_at = None  # type: Tuple[int, int]
+
+        self._done = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._done:
+            return False
+
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+        return False
+
+    def _begin_sql(self) -> str:
+        """
+        :return: The SQL used to begin this transaction.
+        """
+        sql = "BEGIN"
+        if self.isolation is not None:
+            sql += " ISOLATION LEVEL " + self.isolation
+
+        if self.readonly is not None:
+            sql += " READ ONLY" if self.readonly else " READ WRITE"
+
+        return sql
+
+    def _check_current(self):
+        """
+        Checks that this transaction is the innermost one running on the connection.
+        """
+        if self._started_at is None:
+            raise RuntimeError("This transaction has not been started")
+
+        if self._done:
+            raise RuntimeError("This transaction has already finished")
+
+        if self._connection._transactions[-1] is not self:
+            raise RuntimeError("A nested transaction is still running")
+
+    def _unsent(self) -> bool:
+        """
+        :return: If nothing in this transaction has been sent to the server yet.
+        """
+        return self._connection._flushes == self._started_at[0]
+
+    def _finish(self):
+        self._connection._transactions.pop()
+        self._done = True
+
+    async def start(self):
+        """
+        Starts this transaction. This is called automatically when used with ``async with``.
+
+        Nothing is sent to the server until the next statement is executed.
+        """
+        if self._started_at is not None:
+            raise RuntimeError("This transaction has already been started")
+
+        conn = self._connection
+        if conn._transactions:
+            if self.isolation is not None or self.readonly is not None:
+                raise ValueError("Nested transactions cannot change the isolation level or "
+                                 "access mode")
+
+            self._savepoint = "_riopg_savepoint_{}".format(len(conn._transactions))
+            opener = "SAVEPOINT " + self._savepoint
+        else:
+            opener = self._begin_sql()
+
+        self._started_at = (conn._flushes, len(conn._pending))
+        conn._pending.append(opener)
+        conn._transactions.append(self)
+
+    async def commit(self, sql: str = None,
+                     params: Union[Tuple[Any], Dict[str, Any]] = None):
+        """
+        Commits this transaction (or releases the savepoint, if nested).
+
+        :param sql: A final statement to execute in the same round trip as the commit. Any
+            results it returns are discarded.
+        :param params: The parameters to pass to the final statement.
+        """
+        self._check_current()
+        conn = self._connection
+
+        if sql is None and self._unsent():
+            # nothing ever happened
+            del conn._pending[self._started_at[1]:]
+            self._finish()
+            return
+
+        if self._savepoint is not None:
+            end = "RELEASE SAVEPOINT " + self._savepoint
+        else:
+            end = "COMMIT"
+
+        try:
+            if sql is None and self._savepoint is not None:
+                # the outer transaction will send this along with its next statement
+                conn._pending.append(end)
+            elif sql is None:
+                await conn._execute_raw(end)
+            else:
+                conn._check_dirty(sql)
+                await conn._execute_raw(sql + ";\n" + end, params)
+        except BaseException:
+            await self.rollback()
+            raise
+
+        self._finish()
+
+    async def rollback(self):
+        """
+        Rolls back this transaction (or to the savepoint, if nested).
+        """
+        self._check_current()
+        conn = self._connection
+
+        try:
+            if self._unsent():
+                del conn._pending[self._started_at[1]:]
+            elif self._savepoint is not None:
+                conn._pending.append("ROLLBACK TO SAVEPOINT " + self._savepoint)
+                conn._pending.append("RELEASE SAVEPOINT " + self._savepoint)
+            else:
+                # anything still pending belongs to this transaction
+                conn._pending.clear()
+                await conn._execute_raw("ROLLBACK")
+        finally:
+            self._finish()
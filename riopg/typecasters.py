@@ -0,0 +1,120 @@
+# This file is part of riopg.
+#
+# riopg is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# riopg is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with riopg.  If not, see <http://www.gnu.org/licenses/>.
+"""
+.. currentmodule:: riopg.typecasters
+"""
+from typing import Any, Callable, Iterable, Union
+
+from psycopg2.extensions import new_array_type, new_type, register_type
+
+from riopg import connection as md_connection
+
+#: Return values of a type as undecoded strings.
+RAW = "raw"
+
+#: The OID and array OID of each type that can be configured.
+_OIDS = {
+    "json": (114, 199),
+    "jsonb": (3802, 3807),
+    "numeric": (1700, 1231),
+    "uuid": (2950, 2951),
+}
+
+
+def _cast_raw(value, cur):
+    """
+    The cast function for :data:`.RAW` typecasters.
+    """
+    return value
+
+
+def _make_cast(decoder: 'Union[str, Callable[[str], Any]]'):
+    """
+    Makes the cast function for a typecaster that uses the specified decoder.
+    """
+    if decoder == RAW:
+        # psycopg2 has already decoded the value with the connection encoding
+        return _cast_raw
+
+    def cast(value, cur):
+        if value is None:
+            return None
+
+        return decoder(value)
+
+    return cast
+
+
+class TypeCasters(object):
+    """
+    A set of typecasters that are registered on every new connection, replacing the ones
+    psycopg2 uses by default.
+
+    Each type takes either a callable that decodes the string psycopg2 receives from the server,
+    :data:`.RAW` to return that string undecoded, or None to keep the psycopg2 default. Arrays of
+    a configured type use the same decoder for each element.
+
+    .. code-block:: python3
+
+        import orjson
+
+        # decode JSONB with orjson, and pass JSON through without decoding it
+        typecasters = TypeCasters(jsonb=orjson.loads, json=RAW, numeric=float)
+        conn = await Connection.open(dsn, typecasters=typecasters)
+
+    Typecasters apply to every column of a type. To skip decoding a single column, cast it to
+    ``text`` in the query instead.
+    """
+
+    def __init__(self, *,
+                 json: 'Union[str, Callable[[str], Any]]' = None,
+                 jsonb: 'Union[str, Callable[[str], Any]]' = None,
+                 numeric: 'Union[str, Callable[[str], Any]]' = None,
+                 uuid: 'Union[str, Callable[[str], Any]]' = None,
+                 extra: Iterable[Any] = ()):
+        """
+        :param json: The decoder for ``json`` values, e.g. ``orjson.loads``.
+        :param jsonb: The decoder for ``jsonb`` values.
+        :param numeric: The decoder for ``numeric`` values, e.g. ``float``.
+        :param uuid: The decoder for ``uuid`` values, e.g. ``uuid.UUID``.
+        :param extra: Any other typecasters to register, made with
+            :func:`psycopg2.extensions.new_type`.
+        """
+        #: The typecasters registered on each connection.
+        self.casters = []
+
+        decoders = (("json", json), ("jsonb", jsonb), ("numeric", numeric), ("uuid", uuid))
+        for name, decoder in decoders:
+            if decoder is None:
+                continue
+
+            if decoder != RAW and not callable(decoder):
+                raise TypeError("The decoder for {} must be callable or RAW".format(name))
+
+            oid, array_oid = _OIDS[name]
+            caster = new_type((oid,), "RIOPG_" + name.upper(), _make_cast(decoder))
+            array_caster = new_array_type((array_oid,), "RIOPG_" + name.upper() + "ARRAY", caster)
+            self.casters += [caster, array_caster]
+
+        self.casters.extend(extra)
+
+    def register(self, conn: 'md_connection.Connection'):
+        """
+        Registers these typecasters on a connection. This doesn't talk to the server.
+
+        :param conn: The :class:`.Connection` to register these typecasters on.
+        """
+        for caster in self.casters:
+            register_type(caster, conn._connection)